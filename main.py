@@ -1,83 +1,190 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import requests
+from requests.adapters import HTTPAdapter
 import io
-from docx import Document
-from PyPDF2 import PdfReader
+import csv
+import orjson
+import atexit
+import hashlib
+import re
+import time
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+import numpy as np
+import fitz  # PyMuPDF
+from pdf_extract import iter_page_texts
 import logging
-from langdetect import detect
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Dict, Tuple
-import math
+from typing import Dict, List, Tuple, Iterator, Optional, Mapping
 from dataclasses import dataclass
-import pandas as pd
-from datetime import datetime
-import os 
-from dotenv import load_dotenv
 import os
+from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Predefined API keys
 API_KEYS = [os.getenv(f"API_KEY_{i}") for i in range(0, 11)]
 
 MODEL_NAME = "llama-3.3-70b-versatile"
 TRANSLATION_URL = "https://api.groq.com/openai/v1/chat/completions"
+MAX_WORKERS = 32  # Upper bound on concurrent translation threads
+MAX_RATE_LIMIT_WAIT = 30  # Seconds a chunk may wait for a rate-limited key to reset
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=len(API_KEYS), pool_maxsize=len(API_KEYS) * 2)
+    session.mount("https://", adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+# Shared by all worker threads so chunk requests reuse pooled keep-alive connections.
+# Auth headers are passed per call; the session's own headers are never mutated.
+HTTP_SESSION = _build_session()
+atexit.register(HTTP_SESSION.close)
+
+# Only the two message contents change between translation requests, so the JSON
+# around them is serialized once and the per-call body is assembled from bytes.
+_PAYLOAD_PREFIX, _PAYLOAD_MIDDLE, _PAYLOAD_SUFFIX = orjson.dumps({
+    "model": MODEL_NAME,
+    "messages": [
+        {"role": "system", "content": "\0"},
+        {"role": "user", "content": "\0"}
+    ]
+}).split(orjson.dumps("\0"))
+
+@lru_cache(maxsize=None)
+def _encode_system_prompt(target_lang: str) -> bytes:
+    return orjson.dumps(f"Translate the following text to {target_lang}:")
+
+def build_translation_payload(text: str, target_lang: str) -> bytes:
+    return b"".join((
+        _PAYLOAD_PREFIX,
+        _encode_system_prompt(target_lang),
+        _PAYLOAD_MIDDLE,
+        orjson.dumps(text),
+        _PAYLOAD_SUFFIX
+    ))
+
+LANG_SAMPLE_SIZE = 1024
+
+def detect_language(text: str) -> str:
+    # Only the Nepali/English split matters for picking a translation direction,
+    # and Nepali is written in Devanagari (U+0900-U+097F), so a script check on a
+    # short prefix replaces statistical language detection here. In UTF-8 those
+    # code points are E0 A4 xx / E0 A5 xx, which numpy can count without a
+    # Python-level loop over characters. The sample is Nepali only if Devanagari
+    # outnumbers Latin letters, so a quoted Nepali word in English text (or an
+    # English term in Nepali text) does not flip the direction.
+    data = np.frombuffer(text[:LANG_SAMPLE_SIZE].encode("utf-8"), dtype=np.uint8)
+    lead, second = data[:-1], data[1:]
+    devanagari = np.count_nonzero((lead == 0xE0) & ((second == 0xA4) | (second == 0xA5)))
+    lowered = data | 0x20  # ASCII letters folded to lower case
+    latin = np.count_nonzero((lowered >= ord("a")) & (lowered <= ord("z")))
+    return "ne" if devanagari > latin else "en"
+
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_reset_duration(value: str) -> float:
+    """Parse Groq's reset headers, e.g. "7.66s", "2m59.56s" or a bare seconds value."""
+    try:
+        return float(value)
+    except ValueError:
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in _DURATION_RE.findall(value))
+
+def parse_retry_after(value: Optional[str]) -> float:
+    """Parse a Retry-After header (seconds or an HTTP date); 1s if missing or malformed."""
+    if value is None:
+        return 1.0
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return 1.0
 
 @dataclass
 class APIKey:
     key: str
     used_tokens: int = 0
     invalid: bool = False
+    # Last quota reported by Groq's x-ratelimit-* headers; None until a response is seen.
+    requests_remaining: Optional[int] = None
+    tokens_remaining: Optional[int] = None
+    reset_at: float = 0.0  # Epoch time before which the key must not be used
+
+    def is_ready(self, now: float) -> bool:
+        return not self.invalid and self.reset_at <= now
+
+    def block_for(self, seconds: float):
+        self.reset_at = max(self.reset_at, time.time() + seconds)
+
+    def update_rate_limit(self, headers: Mapping[str, str]):
+        for kind in ("requests", "tokens"):
+            remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+            if remaining is None:
+                continue
+            try:
+                remaining = int(remaining)
+            except ValueError:
+                # Bookkeeping only: a malformed header must not fail the request.
+                continue
+            setattr(self, f"{kind}_remaining", remaining)
+            if remaining <= 0:
+                self.block_for(parse_reset_duration(headers.get(f"x-ratelimit-reset-{kind}", "1")))
 
 class ChunkProcessor:
     def __init__(self):
         self.api_keys = [APIKey(key) for key in API_KEYS]
-        self.chunk_size = 8  # Maximum pages per chunk
+        self.session = HTTP_SESSION
 
     def get_next_api_key(self, chunk_index: int) -> APIKey:
-        valid_keys = [key for key in self.api_keys if not key.invalid]
-        if not valid_keys:
-            raise RuntimeError("No valid API keys available.")
-        return valid_keys[chunk_index % len(valid_keys)]
-
-    def create_chunks(self, pages: List[str]) -> List[List[str]]:
-        chunks = []
+        while True:
+            valid_keys = [key for key in self.api_keys if not key.invalid]
+            if not valid_keys:
+                raise RuntimeError("No valid API keys available.")
+
+            now = time.time()
+            ready_keys = [key for key in valid_keys if key.is_ready(now)]
+            if ready_keys:
+                return ready_keys[chunk_index % len(ready_keys)]
+
+            # Every key is rate limited. Short resets (per-minute quotas) are waited
+            # out; long ones (daily quota, large Retry-After) fail the chunk instead
+            # of blocking the Streamlit run.
+            wait = max(0.0, min(key.reset_at for key in valid_keys) - now)
+            if wait > MAX_RATE_LIMIT_WAIT:
+                raise RuntimeError(f"All API keys are rate limited for another {wait:.0f}s.")
+            time.sleep(wait)
+
+    def create_chunks(self, pages: List[str]) -> Iterator[Tuple[int, str]]:
+        # One bucket per API key (or per page for short documents), with sizes
+        # differing by at most one page so every key gets a comparable workload.
+        # Sized from the non-blank pages actually extracted, not doc.page_count,
+        # so scanned or sparse PDFs still spread across every key.
         total_pages = len(pages)
+        num_chunks = min(len(self.api_keys), total_pages)
+        base, remainder = divmod(total_pages, num_chunks)
 
-        num_chunks = min(len(self.api_keys), math.ceil(total_pages / 8))
-        pages_per_chunk = math.ceil(total_pages / num_chunks)
-
-        for i in range(0, total_pages, pages_per_chunk):
-            chunk = pages[i:i + pages_per_chunk]
-            if chunk:
-                chunks.append(chunk)
-
-        return chunks
+        start = 0
+        for chunk_index in range(num_chunks):
+            size = base + (1 if chunk_index < remainder else 0)
+            yield chunk_index, "\n".join(pages[start:start + size])
+            start += size
 
-    def process_chunk(self, chunk: List[str], chunk_index: int) -> Tuple[int, Dict]:
+    def process_chunk(self, combined_text: str, chunk_index: int, digest: bytes) -> Tuple[int, Dict]:
         try:
-            api_key = self.get_next_api_key(chunk_index)
-            combined_text = "\n".join(chunk)
-
-            source_lang = detect(combined_text)
-            target_lang = "English" if source_lang == "ne" else "Nepali"
-            translated = self.translate_text(combined_text, target_lang, api_key)
-
+            translated = cached_translate_chunk(digest, self, combined_text, chunk_index)
             return chunk_index, {
                 "original": combined_text,
                 "translated": translated,
                 "status": "success"
             }
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 401:
-                api_key.invalid = True
-                return self.process_chunk(chunk, chunk_index)
-            return chunk_index, {
-                "original": "",
-                "translated": "",
-                "status": "error",
-                "error": str(e)
-            }
         except Exception as e:
             return chunk_index, {
                 "original": "",
@@ -86,26 +193,45 @@ class ChunkProcessor:
                 "error": str(e)
             }
 
+    def translate_chunk(self, combined_text: str, chunk_index: int) -> str:
+        source_lang = detect_language(combined_text)
+        target_lang = "English" if source_lang == "ne" else "Nepali"
+        # The language and request body do not depend on the key, so they are
+        # computed once and reused by every retry below.
+        body = build_translation_payload(combined_text, target_lang)
+
+        # Each failed attempt either invalidates or rate-limits a key, so allow
+        # every key one rejection plus one retry after its quota resets.
+        for _ in range(2 * len(self.api_keys)):
+            api_key = self.get_next_api_key(chunk_index)
+            try:
+                return self.send_translation(body, api_key)
+            except requests.exceptions.HTTPError as e:
+                if e.response.status_code == 401:
+                    api_key.invalid = True
+                    continue
+                if e.response.status_code == 429:
+                    api_key.block_for(parse_retry_after(e.response.headers.get("retry-after")))
+                    continue
+                raise
+
+        raise RuntimeError("Translation retries exhausted for all API keys.")
+
     def translate_text(self, text: str, target_lang: str, api_key: APIKey) -> str:
-        headers = {
-            'Authorization': f'Bearer {api_key.key}',
-            'Content-Type': 'application/json'
-        }
+        return self.send_translation(build_translation_payload(text, target_lang), api_key)
 
-        data = {
-            "model": MODEL_NAME,
-            "messages": [
-                {"role": "system", "content": f"Translate the following text to {target_lang}:"},
-                {"role": "user", "content": text}
-            ]
-        }
+    def send_translation(self, body: bytes, api_key: APIKey) -> str:
+        headers = {'Authorization': f'Bearer {api_key.key}'}
 
-        response = requests.post(TRANSLATION_URL, json=data, headers=headers)
+        response = self.session.post(TRANSLATION_URL, data=body, headers=headers)
+        api_key.update_rate_limit(response.headers)
         response.raise_for_status()
         api_key.used_tokens += 1
-        return response.json()['choices'][0]['message']['content']
+        return orjson.loads(response.content)['choices'][0]['message']['content']
 
 class TranslationLogger:
+    COLUMNS = ["chunk_id", "source_lang", "target_lang", "original", "translated"]
+
     def __init__(self):
         self.logs = []
 
@@ -118,54 +244,121 @@ class TranslationLogger:
             "translated": translated
         })
 
-    def get_log_df(self):
-        return pd.DataFrame(self.logs)
+    def to_excel(self) -> bytes:
+        # Rows are streamed straight into the sheet; constant_memory flushes each
+        # row as it is written instead of building a DataFrame and cell table.
+        import xlsxwriter
+
+        buffer = io.BytesIO()
+        workbook = xlsxwriter.Workbook(buffer, {"constant_memory": True})
+        worksheet = workbook.add_worksheet()
+        worksheet.write_row(0, 0, self.COLUMNS)
+        for row, log in enumerate(self.logs, 1):
+            worksheet.write_row(row, 0, [log[column] for column in self.COLUMNS])
+        workbook.close()
+        return buffer.getvalue()
+
+    def to_csv(self) -> str:
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=self.COLUMNS)
+        writer.writeheader()
+        writer.writerows(self.logs)
+        return buffer.getvalue()
+
+# Streamlit reruns the script on every interaction, so extraction and each chunk's
+# translation are memoized; re-clicking or toggling widgets never re-sends a chunk
+# that already succeeded. Failed chunks raise and are not cached, so only they are
+# retried on the next run. Memoized functions must not call st.* elements: memo
+# replays those on a cache hit. Arguments prefixed with "_" are not hashed.
+@st.experimental_memo(max_entries=8, show_spinner=False)
+def extract_pages(file_content: bytes) -> List[str]:
+    with fitz.open(stream=file_content, filetype="pdf") as doc:
+        return list(iter_page_texts(doc, file_content))
+
+@st.experimental_memo(max_entries=128, show_spinner=False)
+def cached_translate_chunk(digest: bytes, _processor: ChunkProcessor, _text: str, _chunk_index: int) -> str:
+    return _processor.translate_chunk(_text, _chunk_index)
 
 def process_document(file_content: bytes):
     try:
-        pdf_reader = PdfReader(io.BytesIO(file_content))
-        pages = []
-
-        for page in pdf_reader.pages:
-            text = page.extract_text()
-            if text.strip():
-                pages.append(text)
-
+        pages = extract_pages(file_content)
         if not pages:
             return None
 
         processor = ChunkProcessor()
-        chunks = processor.create_chunks(pages)
-
         results = {}
-        total_chunks = len(chunks)
         progress_bar = st.progress(0)
 
-        with ThreadPoolExecutor(max_workers=total_chunks) as executor:
-            future_to_chunk = {
-                executor.submit(processor.process_chunk, chunk, i): i 
-                for i, chunk in enumerate(chunks)
-            }
+        # Chunk texts are joined lazily as they are submitted.
+        chunks = processor.create_chunks(pages)
+
+        # create_chunks makes at most one chunk per key or page, so more threads
+        # than that would only sit idle. Workers carry the script's run context
+        # so the memoized chunk helper can be called from them.
+        max_workers = min(len(processor.api_keys), len(pages), MAX_WORKERS)
+        with ThreadPoolExecutor(
+            max_workers=max_workers,
+            initializer=add_script_run_ctx,
+            initargs=(None, get_script_run_ctx())
+        ) as executor:
+            future_to_chunk = {}
+            first_chunk_by_digest = {}
+            duplicate_of = {}
+
+            # Identical chunks (repeated boilerplate pages) are translated once and
+            # the result is copied to every position that shares the text.
+            for i, text in chunks:
+                digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+                if digest in first_chunk_by_digest:
+                    duplicate_of[i] = first_chunk_by_digest[digest]
+                    continue
+                first_chunk_by_digest[digest] = i
+                future_to_chunk[executor.submit(processor.process_chunk, text, i, digest)] = i
+
+            total_chunks = len(future_to_chunk) + len(duplicate_of)
+
             completed_chunks = 0
             for future in as_completed(future_to_chunk):
                 chunk_index, result = future.result()
                 results[chunk_index] = result
                 completed_chunks += 1
-                progress_bar.progress(completed_chunks / total_chunks)
-
-        merged_original = []
-        merged_translated = []
-
-        for i in range(len(chunks)):
-            if results[i]["status"] == "success":
-                merged_original.append(f"=== Chunk {i+1} ===\n{results[i]['original']}")
-                merged_translated.append(f"=== Chunk {i+1} ===\n{results[i]['translated']}")
+                progress_bar.progress(completed_chunks / len(future_to_chunk))
+
+        for chunk_index, source_index in duplicate_of.items():
+            results[chunk_index] = results[source_index]
+
+        # Chunks are written straight into the output buffers, and each result is
+        # released once written, instead of building per-chunk copies to join.
+        merged_original = io.StringIO()
+        merged_translated = io.StringIO()
+        separator = ""
+        failed_chunks = 0
+
+        for i in range(total_chunks):
+            result = results.pop(i)
+            if result["status"] == "success":
+                header = f"{separator}=== Chunk {i+1} ===\n"
+                merged_original.write(header)
+                merged_original.write(result["original"])
+                merged_translated.write(header)
+                merged_translated.write(result["translated"])
+                separator = "\n\n---\n\n"
+            else:
+                failed_chunks += 1
+                logger.error(f"Chunk {i+1} failed to translate: {result['error']}")
+
+        if not separator:
+            raise RuntimeError("All chunks failed to translate.")
+        if failed_chunks:
+            st.warning(f"{failed_chunks} of {total_chunks} chunks failed to translate. Process the document again to retry them.")
 
         return {
-            "original": "\n\n---\n\n".join(merged_original),
-            "translated": "\n\n---\n\n".join(merged_translated)
+            "original": merged_original.getvalue(),
+            "translated": merged_translated.getvalue()
         }
     except Exception as e:
+        logger.exception("Document translation failed")
+        st.error(f"Error processing document: {str(e)}")
         return None
 
 def main():
@@ -209,18 +402,20 @@ def main():
                         )
 
                     st.subheader("Translation Logs")
-                    log_df = translation_logger.get_log_df()
-                    st.dataframe(log_df)
+                    st.dataframe(translation_logger.logs)
 
-                    excel_buffer = io.BytesIO()
-                    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-                        log_df.to_excel(writer, index=False)
                     st.download_button(
                         label="Download Logs",
-                        data=excel_buffer.getvalue(),
+                        data=translation_logger.to_excel(),
                         file_name="translation_logs.xlsx",
                         mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
                     )
+                    st.download_button(
+                        label="Download Logs (CSV)",
+                        data=translation_logger.to_csv(),
+                        file_name="translation_logs.csv",
+                        mime="text/csv"
+                    )
 
 if __name__ == "__main__":
     main()
@@ -1,11 +1,16 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import io
-from PyPDF2 import PdfReader
+import atexit
+import re
+from functools import lru_cache
+import fitz  # PyMuPDF
+from pdf_extract import iter_page_texts
 import logging
-from langdetect import detect
-from typing import Tuple, Optional, List
-import json
+from typing import Tuple, Optional, List, Iterable, Iterator
+from itertools import islice
+import orjson
 from tenacity import retry, stop_after_attempt, wait_exponential
 
 # API Configuration
@@ -20,6 +25,54 @@ API_KEYS = [os.getenv(f"API_KEY_{i}") for i in range(9, 11)]
 
 MODEL_NAME = "llama-3.3-70b-versatile"
 MAX_CHUNK_SIZE = 4000  # Maximum text chunk size for API processing
+CHUNKS_PER_REQUEST = 4  # Chunks packed into a single API call (~16k chars, well inside the context window)
+
+TOKEN_RE = re.compile(r"\S+\s*")  # A word plus its trailing whitespace
+
+CHUNK_MARKER = "<<<CHUNK {}>>>"
+CHUNK_MARKER_RE = re.compile(r"<<<CHUNK (\d+)>>>")
+BATCH_INSTRUCTIONS = """
+
+The input is split into sections, each starting with a marker line such as <<<CHUNK 1>>>.
+Handle every section independently. Start the output for each section with its exact
+marker line, and keep the sections in the same order."""
+
+def _build_session() -> requests.Session:
+    """Create a pooled session so repeated API calls reuse keep-alive connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=len(API_KEYS), pool_maxsize=len(API_KEYS) * 2)
+    session.mount("https://", adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+HTTP_SESSION = _build_session()
+atexit.register(HTTP_SESSION.close)
+
+LANG_SAMPLE_SIZE = 1024  # Characters passed to langdetect; its verdict converges well before this
+
+@lru_cache(maxsize=1024)
+def _cached_detect(sample: str) -> str:
+    """Memoize langdetect results per sample; str hashes are cached, so lookups are cheap."""
+    from langdetect import detect  # Deferred: only needed once a PDF is processed
+
+    return detect(sample)
+
+# Serialized once: everything in the request body that precedes the messages.
+_PAYLOAD_PREFIX = orjson.dumps({"model": MODEL_NAME, "messages": []})[:-2]
+
+@lru_cache(maxsize=32)
+def _encode_system_message(content: str) -> bytes:
+    """Serialize a system message; the same few prompts are reused for every batch."""
+    return orjson.dumps({"role": "system", "content": content})
+
+def encode_payload(messages: List[dict]) -> bytes:
+    """Build the chat-completions request body, reusing the pre-serialized parts."""
+    encoded = [
+        _encode_system_message(message["content"]) if message["role"] == "system"
+        else orjson.dumps(message)
+        for message in messages
+    ]
+    return _PAYLOAD_PREFIX + b",".join(encoded) + b"]}"
 
 # Configure logging
 logging.basicConfig(
@@ -37,6 +90,7 @@ class MetadataExtractor:
         self.api_keys = API_KEYS.copy()  # Create a copy to preserve original keys
         self.url = "https://api.groq.com/openai/v1/chat/completions"
         self.current_key_index = 0
+        self.session = HTTP_SESSION
 
     def _get_next_api_key(self) -> str:
         """Get the next available API key using rotation."""
@@ -46,63 +100,82 @@ class MetadataExtractor:
         self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
         return self.api_keys[self.current_key_index]
 
-    def _chunk_text(self, text: str, chunk_size: int = MAX_CHUNK_SIZE) -> List[str]:
-        """Split text into manageable chunks."""
-        words = text.split()
-        chunks = []
-        current_chunk = []
-        current_length = 0
-
-        for word in words:
-            word_length = len(word) + 1  # Add 1 for space
-            if current_length + word_length > chunk_size:
-                chunks.append(' '.join(current_chunk))
-                current_chunk = [word]
-                current_length = word_length
-            else:
-                current_chunk.append(word)
-                current_length += word_length
-
-        if current_chunk:
-            chunks.append(' '.join(current_chunk))
-
-        return chunks
+    def _chunk_text(self, text: str, chunk_size: int = MAX_CHUNK_SIZE) -> Iterator[str]:
+        """Lazily split text into chunks of at most chunk_size characters, preserving whitespace."""
+        chunk_start = None
+        chunk_end = 0
+
+        for match in TOKEN_RE.finditer(text):
+            if chunk_start is None:
+                chunk_start = match.start()
+            elif match.end() - chunk_start > chunk_size:
+                yield text[chunk_start:chunk_end].rstrip()
+                chunk_start = match.start()
+            chunk_end = match.end()
+
+        if chunk_start is not None:
+            yield text[chunk_start:chunk_end].rstrip()
+
+    def _batch_chunks(self, chunks: Iterable[str], batch_size: int = CHUNKS_PER_REQUEST) -> Iterator[List[str]]:
+        """Group consecutive chunks so several are sent in one API call."""
+        chunk_iter = iter(chunks)
+        while batch := list(islice(chunk_iter, batch_size)):
+            yield batch
+
+    @staticmethod
+    def _join_batch(batch: List[str]) -> str:
+        """Prefix each chunk with its marker so the response can be split back out."""
+        return "\n\n".join(f"{CHUNK_MARKER.format(i)}\n{chunk}" for i, chunk in enumerate(batch, 1))
+
+    @staticmethod
+    def _split_batch(content: str) -> List[str]:
+        """Split a batched response on its chunk markers, preserving chunk order."""
+        parts = CHUNK_MARKER_RE.split(content)
+        sections = {int(index): body.strip() for index, body in zip(parts[1::2], parts[2::2])}
+        if not sections:
+            # The model ignored the markers; keep its answer as a single result.
+            return [content.strip()]
+        return [sections[index] for index in sorted(sections)]
+
+    @staticmethod
+    def _write_sections(buffer: io.StringIO, sections: List[str], separator: str):
+        """Append sections to buffer, separated from each other and from earlier output."""
+        for section in sections:
+            if buffer.tell():
+                buffer.write(separator)
+            buffer.write(section)
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
     def _make_api_request(self, messages: List[dict]) -> dict:
         """Make API request with retry logic."""
         api_key = self._get_next_api_key()
-        headers = {
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json',
-        }
-        data = {
-            "model": MODEL_NAME,
-            "messages": messages,
-        }
+        headers = {'Authorization': f'Bearer {api_key}'}
+        body = encode_payload(messages)
 
         try:
-            response = requests.post(self.url, json=data, headers=headers)
+            response = self.session.post(self.url, data=body, headers=headers)
             response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
+            return orjson.loads(response.content)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             logger.error(f"API request failed: {str(e)}")
             raise APIError(f"API request failed: {str(e)}")
 
     def detect_language(self, text: str) -> str:
         """Detect the language of the given text with error handling."""
+        sample = text[:LANG_SAMPLE_SIZE]
+        if not sample or sample.isspace():
+            return "unknown"
         try:
-            return detect(text)
+            return _cached_detect(sample)
         except Exception as e:
             logger.warning(f"Language detection failed: {e}")
             return "unknown"
 
     def extract_metadata(self, text: str) -> str:
         """Extract metadata with improved chunk handling."""
-        chunks = self._chunk_text(text)
-        results = []
+        results = io.StringIO()
 
-        for chunk in chunks:
+        for batch in self._batch_chunks(self._chunk_text(text)):
             messages = [
                 {
                     "role": "system",
@@ -111,56 +184,55 @@ class MetadataExtractor:
                     - author
                     - publication_date
                     - keywords (as array)
-                    - summary (brief)"""
+                    - summary (brief)""" + BATCH_INSTRUCTIONS
                 },
-                {"role": "user", "content": chunk}
+                {"role": "user", "content": self._join_batch(batch)}
             ]
 
             try:
                 response = self._make_api_request(messages)
                 metadata = response["choices"][0]["message"]["content"]
-                results.append(metadata)
+                self._write_sections(results, self._split_batch(metadata), "\n\n")
             except Exception as e:
-                logger.error(f"Metadata extraction failed for chunk: {e}")
+                logger.error(f"Metadata extraction failed for batch: {e}")
                 continue
 
-        return "\n\n".join(results)
+        return results.getvalue()
 
     def translate_text(self, text: str, target_lang: str) -> str:
         """Translate text with improved error handling."""
-        chunks = self._chunk_text(text)
-        translated_chunks = []
+        translated_chunks = io.StringIO()
 
-        for chunk in chunks:
+        for batch in self._batch_chunks(self._chunk_text(text)):
             messages = [
-                {"role": "system", "content": f"Translate the following text to {target_lang}:"},
-                {"role": "user", "content": chunk}
+                {"role": "system", "content": f"Translate the following text to {target_lang}:" + BATCH_INSTRUCTIONS},
+                {"role": "user", "content": self._join_batch(batch)}
             ]
 
             try:
                 response = self._make_api_request(messages)
-                translated_chunk = response["choices"][0]["message"]["content"]
-                translated_chunks.append(translated_chunk)
+                translated_batch = response["choices"][0]["message"]["content"]
+                self._write_sections(translated_chunks, self._split_batch(translated_batch), "\n")
             except Exception as e:
-                logger.error(f"Translation failed for chunk: {e}")
+                logger.error(f"Translation failed for batch: {e}")
                 continue
 
-        return "\n".join(translated_chunks)
+        return translated_chunks.getvalue()
+
+@st.experimental_memo(max_entries=8, show_spinner=False)
+def cached_extract_metadata(text: str) -> str:
+    """Extract metadata once per distinct document text across Streamlit reruns."""
+    metadata = MetadataExtractor().extract_metadata(text)
+    if not metadata:
+        # Raise instead of returning so an all-failed run is not cached.
+        raise APIError("Metadata extraction returned no results.")
+    return metadata
 
 def process_pdf(file_content: bytes) -> Tuple[Optional[str], Optional[str]]:
     """Process PDF with enhanced error handling."""
     try:
-        pdf_reader = PdfReader(io.BytesIO(file_content))
-        pages = []
-        
-        for page in pdf_reader.pages:
-            try:
-                text = page.extract_text()
-                if text.strip():
-                    pages.append(text)
-            except Exception as e:
-                logger.error(f"Error extracting text from page: {e}")
-                continue
+        with fitz.open(stream=file_content, filetype="pdf") as doc:
+            pages = list(iter_page_texts(doc, file_content))
 
         if not pages:
             raise ValueError("No extractable text found in the document.")
@@ -168,7 +240,7 @@ def process_pdf(file_content: bytes) -> Tuple[Optional[str], Optional[str]]:
         extractor = MetadataExtractor()
         detected_language = extractor.detect_language(pages[0])
         combined_text = "\n\n".join(pages)
-        metadata = extractor.extract_metadata(combined_text)
+        metadata = cached_extract_metadata(combined_text)
 
         return metadata, detected_language
 
@@ -0,0 +1,95 @@
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Iterator, List, Optional
+
+import fitz  # PyMuPDF
+
+logger = logging.getLogger(__name__)
+
+# Each worker is a fresh interpreter that imports only fitz (roughly 0.1-0.2 s to
+# start), while MuPDF extracts a typical page in a few milliseconds. Below this
+# many pages per worker, start-up costs more than the parallelism saves.
+# Estimated from those figures, not benchmarked.
+MIN_PAGES_PER_WORKER = 64
+WORKER_TIMEOUT = 60  # Seconds to wait on each extraction worker before falling back
+
+def _iter_page_range(doc, start: int, stop: int) -> Iterator[str]:
+    """Yield the non-blank page texts in [start, stop); failing pages are logged and skipped."""
+    for page_index in range(start, stop):
+        try:
+            text = doc[page_index].get_text("text")
+        except Exception as e:
+            logger.error(f"Error extracting text from page {page_index + 1}: {e}")
+            continue
+        if text and not text.isspace():
+            yield text
+
+def _extract_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Worker entry point: each process opens its own copy of the document."""
+    with fitz.open(path) as doc:
+        return list(_iter_page_range(doc, start, stop))
+
+def _collect_worker(process: subprocess.Popen) -> Optional[List[str]]:
+    """Return a worker's page texts, or None if it times out, exits non-zero or prints bad output."""
+    try:
+        output, _ = process.communicate(timeout=WORKER_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        return None
+    if process.returncode != 0:
+        return None
+    try:
+        return json.loads(output)
+    except ValueError:
+        return None
+
+def iter_page_texts(doc, file_content: bytes) -> Iterator[str]:
+    """Yield the non-blank page texts of an open document, in page order.
+
+    PyMuPDF objects must not be shared between threads, so large documents are
+    split into contiguous page ranges that are extracted in worker processes
+    from ``file_content``. Small documents are read directly from ``doc``.
+    """
+    page_count = doc.page_count
+    workers = min(os.cpu_count() or 1, page_count // MIN_PAGES_PER_WORKER)
+    if workers < 2:
+        yield from _iter_page_range(doc, 0, page_count)
+        return
+
+    bounds = [page_count * i // workers for i in range(workers + 1)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, "document.pdf")
+        with open(path, "wb") as f:
+            f.write(file_content)
+
+        # Workers run this file as a plain script. multiprocessing's spawn would
+        # re-run the Streamlit page (installed as __main__) in every child.
+        ranges = list(zip(bounds[:-1], bounds[1:]))
+        processes = [
+            subprocess.Popen([sys.executable, __file__, path, str(start), str(stop)], stdout=subprocess.PIPE)
+            for start, stop in ranges
+        ]
+        try:
+            for process, (start, stop) in zip(processes, ranges):
+                texts = _collect_worker(process)
+                if texts is None:
+                    # A hung or failed worker costs only its own range, which is
+                    # re-read here rather than aborting the whole document.
+                    logger.warning(f"Extraction worker for pages {start + 1}-{stop} failed; extracting in-process")
+                    texts = _iter_page_range(doc, start, stop)
+                yield from texts
+        finally:
+            for process in processes:
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+
+if __name__ == "__main__":
+    # Worker mode for iter_page_texts: print one page range's texts as JSON.
+    logging.basicConfig(level=logging.INFO)
+    json.dump(_extract_page_range(sys.argv[1], int(sys.argv[2]), int(sys.argv[3])), sys.stdout)